@@ -0,0 +1,135 @@
+# Fichier: shared_resources.py
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def config_key(dims):
+    """Clé unique d'une configuration de dimensions (même critère que la table pallet_configs)."""
+    p, b = dims['pallet_dims'], dims['box_dims']
+    return (p['L'], p['W'], b['l'], b['w'])
+
+
+def connect_database(db_config):
+    """Ouvre une nouvelle connexion à la BDD à partir du bloc 'database' de la config."""
+    # Import différé : le pilote est chargé en arrière-plan au démarrage (voir startup.py)
+    import pymysql
+    return pymysql.connect(
+        host=db_config['host'],
+        user=db_config['user'],
+        password=db_config['password'],
+        database=db_config['db'],
+        cursorclass=pymysql.cursors.DictCursor,
+        connect_timeout=5
+    )
+
+
+class TemplateCache:
+    """Cache mémoire des templates, partagé entre toutes les lignes du daemon."""
+
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get(self, dims):
+        with self._lock:
+            return self._templates.get(config_key(dims))
+
+    def put(self, dims, templates):
+        if not templates: return
+        with self._lock:
+            self._templates[config_key(dims)] = templates
+
+    def invalidate(self, dims):
+        """Oublie une configuration, par ex. quand ses templates ont été supprimés ou régénérés en BDD."""
+        with self._lock:
+            self._templates.pop(config_key(dims), None)
+
+
+class DBPool:
+    """
+    Pool de connexions BDD borné. Une connexion empruntée est réservée à un seul
+    watcher jusqu'à ce qu'il la rende (release) ou la jette (discard).
+    """
+
+    def __init__(self, db_config, size=4, acquire_timeout=5):
+        self.db_config = db_config
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("Aucune connexion BDD disponible dans le pool.")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return connect_database(self.db_config)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        # Termine la transaction en cours pour que le prochain emprunteur voie les écritures des autres lignes
+        try:
+            conn.rollback()
+        except Exception:
+            return self.discard(conn)
+        self._idle.put(conn)
+        self._slots.release()
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._slots.release()
+
+
+class EngineQueue:
+    """
+    File de calcul partagée : limite le nombre de générations simultanées et
+    regroupe les demandes identiques en cours sur une seule exécution.
+    """
+
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="engine")
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, dims, job):
+        """Retourne le Future de la génération pour ces dimensions, en la lançant si besoin."""
+        key = config_key(dims)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                print(f"ENGINE QUEUE: Génération déjà en cours pour {key}, attente du résultat.")
+                return future
+            future = self._executor.submit(job)
+            self._in_flight[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+
+class SharedResources:
+    """Ressources communes à toutes les lignes d'un daemon multi-lignes."""
+
+    def __init__(self, config):
+        max_generations = config['engine'].get('max_concurrent_generations', 1)
+        # Une connexion par ligne (gardée pendant tout un ordre) + une par génération en cours (écriture)
+        min_pool_size = len(config['lines']) + max_generations
+        pool_size = config['database'].get('pool_size', min_pool_size)
+        if pool_size < min_pool_size:
+            print(f"⚠️ database.pool_size={pool_size} < {min_pool_size} (lignes + générations simultanées) : "
+                  f"des lignes pourront passer en mode fallback JSON faute de connexion disponible.")
+
+        self.template_cache = TemplateCache()
+        self.db_pool = DBPool(config['database'], size=pool_size)
+        self.engine_queue = EngineQueue(max_workers=max_generations)
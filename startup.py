@@ -0,0 +1,66 @@
+# Fichier: startup.py
+import json
+import threading
+import time
+from datetime import datetime
+
+# Référence de temps prise au tout début du démarrage (ce module est importé en premier par watcher.py)
+PROCESS_START = time.perf_counter()
+PROCESS_START_DATE = datetime.now()
+
+
+class StartupTracker:
+    """
+    Mesure le coût d'un (re)démarrage : délai avant la première scrutation de l'automate
+    et délai avant d'être prêt à générer (OR-Tools et pilote BDD chargés, solveur préchauffé).
+    Le chargement lourd se fait dans un thread de fond pour ne pas retarder la scrutation.
+    """
+
+    def __init__(self, config):
+        self.config = config['watcher']
+        self.time_to_first_poll = None
+        self.time_to_ready = None
+        self.warmup_error = None
+        # Positionné uniquement si le chargement et le préchauffage ont réussi
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start_background_warmup(self):
+        threading.Thread(target=self._warmup, name="warmup", daemon=True).start()
+
+    def _warmup(self):
+        try:
+            import pymysql  # noqa: F401
+            import pallet_engine
+            if self.config.get('warmup_on_start', True):
+                # Petite résolution CP-SAT pour payer l'initialisation native avant la première vraie demande
+                pallet_engine.solve_layer(4, 2, 2, 1, time_limit=1, workers=1)
+        except Exception as e:
+            print(f"⚠️ Préchauffage du moteur impossible : {e}")
+            self.warmup_error = str(e)
+            self._record({"warmup_error": self.warmup_error})
+            return
+        self.time_to_ready = time.perf_counter() - PROCESS_START
+        self.ready.set()
+        print(f"✅ Moteur prêt pour la génération ({self.time_to_ready:.2f}s après le démarrage).")
+        self._record({"time_to_ready_seconds": round(self.time_to_ready, 3)})
+
+    def mark_first_poll(self):
+        """À appeler après chaque lecture réussie du statut ; seule la première est mesurée."""
+        with self._lock:
+            if self.time_to_first_poll is not None: return
+            self.time_to_first_poll = time.perf_counter() - PROCESS_START
+        print(f"✅ Première scrutation de l'automate ({self.time_to_first_poll:.2f}s après le démarrage).")
+        self._record({"time_to_first_poll_seconds": round(self.time_to_first_poll, 3)})
+
+    def _record(self, milestone):
+        """
+        Ajoute une ligne au journal de démarrage dès qu'une étape est franchie, identifiée par
+        'started_at' : une mesure n'est pas perdue si l'autre n'arrive jamais (automate injoignable).
+        """
+        entry = {"started_at": PROCESS_START_DATE.isoformat(timespec='seconds'), **milestone}
+        try:
+            with self._lock, open(self.config.get('startup_log', 'startup_metrics.jsonl'), 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"⚠️ Impossible d'écrire le journal de démarrage : {e}")
@@ -1,11 +1,13 @@
 # Fichier: watcher.py
 
+# Importé en premier pour dater le démarrage du processus
+from startup import StartupTracker
 import json
+import threading
 import time
-import pymysql
-import pallet_engine
 import db_fallback
 from sender import ModbusSender
+from shared_resources import SharedResources, connect_database
 
 
 class Watcher:
@@ -14,9 +16,15 @@ class Watcher:
     et orchestre la génération de templates de palettisation.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, shared=None, name=None, startup=None):
         self.config = config
+        self.name = name
+        self.startup = startup
         self.sender = ModbusSender(config)
+        # Ressources partagées entre lignes (mode multi-lignes), sinon None
+        self.template_cache = shared.template_cache if shared else None
+        self.db_pool = shared.db_pool if shared else None
+        self.engine_queue = shared.engine_queue if shared else None
         self.db_conn = None
         self.db_cursor = None
         self.db_online = False
@@ -28,31 +36,61 @@ class Watcher:
         self.last_sent_template_index = -1
         self.last_production_template_id = -1
 
+    def _log(self, message):
+        """Affiche un message, préfixé du nom de la ligne en mode multi-lignes."""
+        print(f"[{self.name}] {message}" if self.name else message)
+
     def _connect_db(self):
         """Tente de se connecter à la BDD. Gère l'état de la connexion."""
+        if self.db_pool is not None:
+            return self._acquire_pooled_db()
         try:
-            # Si la connexion existe déjà, un ping suffit pour vérifier si elle est active
-            if self.db_conn and self.db_conn.ping(reconnect=True):
+            # Si la connexion existe déjà, un ping suffit (il rouvre la connexion si elle est tombée)
+            if self.db_conn:
+                self.db_conn.ping(reconnect=True)
                 self.db_online = True
                 return
 
-            self.db_conn = pymysql.connect(
-                host=self.config['database']['host'],
-                user=self.config['database']['user'],
-                password=self.config['database']['password'],
-                database=self.config['database']['db'],
-                cursorclass=pymysql.cursors.DictCursor,
-                connect_timeout=5
-            )
+            self.db_conn = connect_database(self.config['database'])
             self.db_cursor = self.db_conn.cursor()
             self.db_online = True
-            print("✅ Connexion à la base de données réussie.")
+            self._log("✅ Connexion à la base de données réussie.")
         except Exception as e:
             if self.db_online:  # Si la connexion vient d'être perdue
-                print(f"⚠️ ERREUR de connexion BDD : {e}. Passage en mode fallback JSON.")
+                self._log(f"⚠️ ERREUR de connexion BDD : {e}. Passage en mode fallback JSON.")
+            self.db_online = False
+            self.db_conn = None
+
+    def _acquire_pooled_db(self):
+        """Emprunte une connexion au pool partagé (gardée jusqu'à la fin de l'ordre en cours)."""
+        try:
+            if self.db_conn is None:
+                self.db_conn = self.db_pool.acquire()
+                self.db_cursor = self.db_conn.cursor()
+            self.db_conn.ping(reconnect=True)
+            self.db_online = True
+        except Exception as e:
+            if self.db_online:
+                self._log(f"⚠️ ERREUR de connexion BDD : {e}. Passage en mode fallback JSON.")
+            if self.db_conn is not None:
+                self.db_pool.discard(self.db_conn)
             self.db_online = False
             self.db_conn = None
 
+    def _release_db(self):
+        """Rend la connexion empruntée au pool partagé ; sans pool, termine seulement la transaction en cours."""
+        if self.db_conn is None: return
+        if self.db_pool is None:
+            # La connexion est conservée d'un ordre à l'autre : le prochain doit voir les écritures récentes
+            try:
+                self.db_conn.rollback()
+            except Exception:
+                pass
+            return
+        self.db_pool.release(self.db_conn)
+        self.db_conn = None
+        self.db_cursor = None
+
     def _get_config_id(self, dims, create_if_not_exists=False):
         """Trouve l'ID d'une configuration de dimensions, ou la crée si besoin."""
         if not self.db_online: return None
@@ -74,69 +112,124 @@ class Watcher:
                 return self.db_cursor.lastrowid
             return None
         except Exception as e:
-            print(f"Erreur BDD (_get_config_id): {e}")
+            self._log(f"Erreur BDD (_get_config_id): {e}")
             self._connect_db()  # Tente de se reconnecter
             return None
 
     def _load_or_generate_templates(self, dims):
-        """Charge les templates depuis la BDD ou le fallback, ou les génère si inexistants."""
-        self._connect_db()
+        """Charge les templates depuis le cache partagé, la BDD ou le fallback, ou les génère si inexistants."""
+        if self.template_cache is not None:
+            cached = self.template_cache.get(dims)
+            if cached:
+                self._log(f"Trouvé {len(cached)} templates dans le cache partagé.")
+                return cached
 
         # 1. Essayer de charger depuis la BDD
-        if self.db_online:
-            config_id = self._get_config_id(dims)
-            if config_id:
-                self.db_cursor.execute(
-                    "SELECT *, template_data as template_json FROM generated_templates WHERE config_id = %s ORDER BY score DESC",
-                    (config_id,))
-                templates_db = self.db_cursor.fetchall()
-                if templates_db:
-                    print(f"Trouvé {len(templates_db)} templates dans la BDD.")
-                    for tpl in templates_db:
-                        tpl['template_data'] = json.loads(tpl['template_json'])
-                    return templates_db
-
-        # 2. Si échec BDD, essayer de charger depuis le fallback JSON
+        templates_db = self._load_db_templates(dims)
+        if templates_db:
+            return templates_db
+
+        # 2. Si échec BDD, essayer de charger depuis le fallback JSON (jamais mis en cache : pas d'ID BDD)
         templates_fallback = db_fallback.load_templates(dims)
         if templates_fallback and "templates" in templates_fallback:
             return templates_fallback["templates"]
 
         # 3. Si tout échoue, générer de nouvelles solutions
-        print("Aucun template trouvé en BDD ou en fallback. Lancement du moteur de calcul...")
+        self._log("Aucun template trouvé en BDD ou en fallback. Lancement du moteur de calcul...")
+        if self.startup is not None and not self.startup.ready.is_set():
+            self._log("  Moteur non préchauffé (en cours ou en échec) : la génération inclura le chargement d'OR-Tools.")
+        if self.engine_queue is not None:
+            # Une génération dure plusieurs minutes : on ne garde pas de connexion du pool pendant l'attente
+            self._release_db()
+            return self.engine_queue.submit(dims, lambda: self._generate_templates_queued(dims)).result()
+        return self._generate_templates(dims)
+
+    def _load_db_templates(self, dims):
+        """Charge les templates d'une configuration depuis la BDD (avec leur ID) et les met en cache."""
+        self._connect_db()
+        if not self.db_online: return []
+        return self._fetch_db_templates(dims)
+
+    def _fetch_db_templates(self, dims):
+        """Lit les templates d'une configuration sur la connexion BDD déjà ouverte."""
+        config_id = self._get_config_id(dims)
+        if not config_id: return []
+
+        self.db_cursor.execute(
+            "SELECT *, template_data as template_json FROM generated_templates WHERE config_id = %s ORDER BY score DESC",
+            (config_id,))
+        templates_db = self.db_cursor.fetchall()
+        if not templates_db: return []
+
+        self._log(f"Trouvé {len(templates_db)} templates dans la BDD.")
+        for tpl in templates_db:
+            tpl['template_data'] = json.loads(tpl['template_json'])
+        if self.template_cache is not None:
+            self.template_cache.put(dims, templates_db)
+        return templates_db
+
+    def _generate_templates_queued(self, dims):
+        """
+        Tâche exécutée dans la file de calcul partagée. Revérifie le cache et la BDD, car une
+        autre ligne a pu terminer la même génération entre notre lecture et notre soumission.
+        """
+        cached = self.template_cache.get(dims)
+        if cached:
+            return cached
+        try:
+            templates_db = self._load_db_templates(dims)
+            # La connexion n'est pas gardée pendant le calcul, seulement pour l'écriture
+            self._release_db()
+            if templates_db:
+                return templates_db
+            return self._generate_templates(dims)
+        finally:
+            self._release_db()
+
+    def _generate_templates(self, dims):
+        """Lance le moteur de calcul et sauvegarde les nouvelles solutions (BDD et fallback)."""
+        # Import différé : OR-Tools est chargé en arrière-plan au démarrage (voir startup.py)
+        import pallet_engine
         results = pallet_engine.generate_pallet_solutions(
             pallet_dims=dims['pallet_dims'], box_dims=dims['box_dims'],
             num_solutions=self.config['engine']['num_solutions_to_find'],
             workers=self.config['engine']['workers']
         )
 
-        if "templates" in results and results["templates"]:
-            if self.db_online:
-                config_id = self._get_config_id(dims, create_if_not_exists=True)
-                for tpl in results['templates']:
-                    self.db_cursor.execute(
-                        "INSERT INTO generated_templates (config_id, template_data, score) VALUES (%s, %s, %s)",
-                        (config_id, json.dumps(tpl), tpl['score'])
-                    )
-                self.db_conn.commit()
-                print("Nouveaux templates sauvegardés en BDD.")
+        if "templates" not in results or not results["templates"]:
+            return []
 
-            db_fallback.save_templates(dims, results)
-            return results['templates']
+        db_fallback.save_templates(dims, results)
 
-        return []
+        self._connect_db()
+        if self.db_online:
+            config_id = self._get_config_id(dims, create_if_not_exists=True)
+            for tpl in results['templates']:
+                self.db_cursor.execute(
+                    "INSERT INTO generated_templates (config_id, template_data, score) VALUES (%s, %s, %s)",
+                    (config_id, json.dumps(tpl), tpl['score'])
+                )
+            self.db_conn.commit()
+            self._log("Nouveaux templates sauvegardés en BDD.")
+            # Relecture pour récupérer les ID BDD, nécessaires à la mise en production
+            templates_db = self._fetch_db_templates(dims)
+            if templates_db:
+                return templates_db
+
+        return results['templates']
 
     def handle_display_request(self):
         """Gère la commande 'afficher un modèle' (statut=1)."""
         dims = self.sender.read_dimensions()
         if not dims:
-            print("  ❌ Impossible de lire les dimensions depuis l'automate.")
+            self._log("  ❌ Impossible de lire les dimensions depuis l'automate.")
             return
 
         self.current_dims = dims
         self.current_templates = self._load_or_generate_templates(dims)
 
         if not self.current_templates:
-            print("  ❌ Aucun template disponible pour ces dimensions.")
+            self._log("  ❌ Aucun template disponible pour ces dimensions.")
             self.sender.write_32bit_int(self.config['modbus_addresses']['template_count'], 0)
             return
 
@@ -146,7 +239,7 @@ class Watcher:
         req_index = req_index - 1 if req_index is not None and req_index > 0 else 0
 
         if not (0 <= req_index < len(self.current_templates)):
-            print(f"  Index demandé ({req_index + 1}) invalide. Affichage du premier.")
+            self._log(f"  Index demandé ({req_index + 1}) invalide. Affichage du premier.")
             req_index = 0
 
         self.last_sent_template_index = req_index
@@ -158,12 +251,12 @@ class Watcher:
     def handle_set_production_request(self):
         """Gère la commande 'mettre en production' (statut=2)."""
         if self.last_sent_template_index == -1 or not self.current_dims:
-            print("  ❌ Commande invalide: aucun template n'a été affiché récemment.")
+            self._log("  ❌ Commande invalide: aucun template n'a été affiché récemment.")
             return
 
         self._connect_db()
         if not self.db_online:
-            print("  ❌ Impossible de mettre en production: connexion BDD requise.")
+            self._log("  ❌ Impossible de mettre en production: connexion BDD requise.")
             return
 
         config_id = self._get_config_id(self.current_dims)
@@ -182,18 +275,26 @@ class Watcher:
         template_id_to_set = self.current_templates[self.last_sent_template_index]['id']
         self.db_cursor.execute("UPDATE generated_templates SET is_in_production = TRUE WHERE id = %s",
                                (template_id_to_set,))
+        if self.db_cursor.rowcount == 0:
+            # Le template affiché n'existe plus en BDD (supprimé ou régénéré) : on annule et on oublie le cache
+            self.db_conn.rollback()
+            if self.template_cache is not None:
+                self.template_cache.invalidate(self.current_dims)
+            self.last_sent_template_index = -1
+            self._log(f"  ❌ Template ID {template_id_to_set} introuvable en BDD. Réafficher un modèle avant la mise en production.")
+            return
         self.db_conn.commit()
-        print(f"  ✅ Template ID {template_id_to_set} mis en production.")
+        self._log(f"  ✅ Template ID {template_id_to_set} mis en production.")
 
     def handle_revert_request(self):
         """Gère la commande 'retour arrière' (statut=3)."""
         if self.last_production_template_id == -1:
-            print("  ❌ Commande invalide: aucun modèle de production précédent n'est mémorisé.")
+            self._log("  ❌ Commande invalide: aucun modèle de production précédent n'est mémorisé.")
             return
 
         self._connect_db()
         if not self.db_online:
-            print("  ❌ Impossible de faire un retour arrière: connexion BDD requise.")
+            self._log("  ❌ Impossible de faire un retour arrière: connexion BDD requise.")
             return
 
         config_id = self._get_config_id(self.current_dims)
@@ -211,18 +312,18 @@ class Watcher:
         if template_to_send_db:
             template_to_send = json.loads(template_to_send_db['template_data'])
             self.sender.send_template(template_to_send)
-            print(f"  ✅ Retour au modèle de production précédent (ID: {self.last_production_template_id}).")
+            self._log(f"  ✅ Retour au modèle de production précédent (ID: {self.last_production_template_id}).")
             self.last_production_template_id = -1
 
     def run(self):
         """Boucle principale du watcher, conçue pour tourner 24/7."""
-        print("--- 🚀 WATCHER DÉMARRÉ ---")
+        self._log("--- 🚀 WATCHER DÉMARRÉ ---")
         while True:
             try:
                 if not self.sender.is_connected():
-                    print("PLC non connecté. Tentative...")
+                    self._log("PLC non connecté. Tentative...")
                     if self.sender.connect():
-                        print("✅ Reconnexion PLC réussie.")
+                        self._log("✅ Reconnexion PLC réussie.")
                         self.sender.write_32bit_int(self.config['modbus_addresses']['error_status'], 0)
                     else:
                         time.sleep(5)
@@ -231,12 +332,15 @@ class Watcher:
                 status = self.sender.read_32bit_int(self.config['modbus_addresses']['status'])
 
                 if status is None:
-                    print("Perte de communication avec l'automate...")
+                    self._log("Perte de communication avec l'automate...")
                     self.sender.disconnect()
                     continue
 
+                if self.startup is not None:
+                    self.startup.mark_first_poll()
+
                 if status != self.last_status and status != 0:
-                    print(f"🔥 Ordre reçu : {status}")
+                    self._log(f"🔥 Ordre reçu : {status}")
                     self.last_status = status
                     self.sender.write_32bit_int(self.config['modbus_addresses']['status'], 9)
 
@@ -246,8 +350,9 @@ class Watcher:
                         self.handle_set_production_request()
                     elif status == 3:
                         self.handle_revert_request()
+                    self._release_db()
 
-                    print("  Tâche terminée. Retour au statut d'attente.")
+                    self._log("  Tâche terminée. Retour au statut d'attente.")
                     self.sender.write_32bit_int(self.config['modbus_addresses']['status'], 0)
                     self.last_status = 0
 
@@ -255,19 +360,72 @@ class Watcher:
                     self.last_status = 0
 
             except Exception as e:
-                print(f"❌ ERREUR CRITIQUE DANS LA BOUCLE : {e}. Tentative de poursuite...")
+                self._log(f"❌ ERREUR CRITIQUE DANS LA BOUCLE : {e}. Tentative de poursuite...")
+                if self.db_conn is not None and self.db_pool is not None:
+                    self.db_pool.discard(self.db_conn)
+                    self.db_conn = None
                 try:
                     if not self.sender.is_connected(): self.sender.connect()
                     self.sender.write_32bit_int(self.config['modbus_addresses']['error_status'], 1)
                 except Exception as e2:
-                    print(f"Impossible de signaler l'erreur à l'automate : {e2}")
+                    self._log(f"Impossible de signaler l'erreur à l'automate : {e2}")
 
             time.sleep(self.config['watcher']['polling_interval_seconds'])
 
 
+def build_line_configs(config):
+    """
+    Construit la config de chaque entrée de config['lines'] : ses propres blocs 'plc' et
+    'modbus_addresses', les autres blocs étant communs. Lève ValueError si une ligne est
+    incomplète ou si deux lignes visent le même automate.
+    """
+    common = {key: value for key, value in config.items() if key != 'lines'}
+    line_configs = []
+    seen_plcs = {}
+    for i, line in enumerate(config['lines']):
+        name = line.get('name', f"ligne {i + 1}")
+        missing = [block for block in ('plc', 'modbus_addresses') if block not in line]
+        if missing:
+            raise ValueError(f"Ligne '{name}' : bloc(s) {', '.join(missing)} manquant(s) dans config['lines'].")
+
+        plc = line['plc']
+        plc_key = (plc['ip'], plc['port'], plc['unit_id'])
+        if plc_key in seen_plcs:
+            raise ValueError(f"Lignes '{seen_plcs[plc_key]}' et '{name}' : même automate {plc_key}.")
+        seen_plcs[plc_key] = name
+
+        line_configs.append((name, {**common, 'plc': plc, 'modbus_addresses': line['modbus_addresses']}))
+    return line_configs
+
+
+def run_multi_line(config, startup=None):
+    """
+    Mode multi-lignes : un watcher par entrée de config['lines'], chacun dans son thread,
+    avec un cache de templates, un pool BDD et une file de calcul communs.
+    """
+    # Validation avant tout démarrage : une config invalide ne doit lancer aucune ligne
+    line_configs = build_line_configs(config)
+    shared = SharedResources(config)
+    threads = []
+    for name, line_config in line_configs:
+        watcher = Watcher(line_config, shared=shared, name=name, startup=startup)
+        thread = threading.Thread(target=watcher.run, name=name, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+
 if __name__ == "__main__":
     with open('config.json', 'r') as f:
         config = json.load(f)
 
-    watcher = Watcher(config)
-    watcher.run()
\ No newline at end of file
+    startup = StartupTracker(config)
+    startup.start_background_warmup()
+
+    if config.get('lines'):
+        run_multi_line(config, startup=startup)
+    else:
+        watcher = Watcher(config, startup=startup)
+        watcher.run()
\ No newline at end of file